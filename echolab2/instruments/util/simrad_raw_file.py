@@ -50,18 +50,129 @@ Simrad .raw datagram format
 '''
 
 from io import BufferedReader, FileIO, SEEK_SET, SEEK_CUR, SEEK_END
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import os
+import mmap
+import array
 import datetime
 import struct
+import numpy as np
 import logging
-import re
+import threading
 from . import simrad_parsers
 
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
 __all__ = ['RawSimradFile']
 
 log = logging.getLogger(__name__)
 
 UTC_NT_EPOCH = datetime.datetime(1601, 1, 1, 0, 0, 0)#, tzinfo=pytz_utc)
 
+#  precompiled structs for the fields we unpack for every datagram. Using
+#  a compiled Struct avoids re-parsing the format string on each call.
+_DGRAM_SIZE_STRUCT = struct.Struct('=l')
+_TIMESTAMP_STRUCT = struct.Struct('=2L')
+_RAW0_CHAN_STRUCT = struct.Struct('=h')
+_RAW3_CHANID_STRUCT = struct.Struct('=128s')
+
+#  the number of bytes we ask the OS to read ahead when scanning a file
+_SCAN_READAHEAD_BYTES = 64 * 1024 * 1024
+
+#  datagram types searched for when trying to find the next valid datagram
+#  (don't search for non-repeating datagrams)
+_RESYNC_DGRAM_TYPES = [b'RAW', b'NME', b'TAG', b'BOT', b'DEP', b'XML', b'MRU']
+
+#  if Hyperscan is available, compile the datagram types into a database
+#  which is much faster than the regex when scanning large buffers.
+_RESYNC_DB = None
+if hyperscan is not None:
+    try:
+        _RESYNC_DB = hyperscan.Database()
+        _RESYNC_DB.compile(expressions=_RESYNC_DGRAM_TYPES,
+                ids=list(range(len(_RESYNC_DGRAM_TYPES))),
+                elements=len(_RESYNC_DGRAM_TYPES),
+                flags=[hyperscan.HS_FLAG_SOM_LEFTMOST] * len(_RESYNC_DGRAM_TYPES))
+    except hyperscan.error:
+        _RESYNC_DB = None
+
+#  Hyperscan scratch space can't be shared by concurrent scans so each thread
+#  gets its own.
+_resync_local = threading.local()
+
+
+def _get_resync_scratch():
+    '''
+    Returns the calling thread's Hyperscan scratch space for _RESYNC_DB.
+    '''
+
+    scratch = getattr(_resync_local, 'scratch', None)
+    if scratch is None:
+        scratch = hyperscan.Scratch(_RESYNC_DB)
+        _resync_local.scratch = scratch
+
+    return scratch
+
+
+def _search_dgram_types(buf):
+    '''
+    Searches buf for the first occurrence of one of the datagram types in
+    _RESYNC_DGRAM_TYPES. Returns a tuple containing the offset of the match
+    and the matched type or None if there is no match.
+    '''
+
+    if _RESYNC_DB is not None:
+        match = []
+
+        def on_match(id_, start, end, flags, context):
+            #  matches are reported in order and all of our types are the
+            #  same length so the first match is the one we want
+            match.append((start, _RESYNC_DGRAM_TYPES[id_]))
+            #  returning True stops the scan
+            return True
+
+        try:
+            _RESYNC_DB.scan(buf, match_event_handler=on_match,
+                    scratch=_get_resync_scratch())
+            scanned = True
+        except hyperscan.ScanTerminated:
+            scanned = True
+        except hyperscan.error as e:
+            #  don't let a Hyperscan failure stop the resync, fall back to
+            #  the bytes.find search below
+            log.warning('Hyperscan scan failed, falling back to bytes.find: %s', e)
+            scanned = False
+
+        if scanned:
+            if match:
+                return match[0]
+            else:
+                return None
+
+    #  Without Hyperscan, search for each type with bytes.find and keep the
+    #  earliest. Each search only needs to cover the buffer up to the best
+    #  match found so far.
+    best = -1
+    best_type = None
+    for dgram_type in _RESYNC_DGRAM_TYPES:
+        if best == -1:
+            idx = buf.find(dgram_type)
+        else:
+            idx = buf.find(dgram_type, 0, best + len(dgram_type) - 1)
+        if idx != -1:
+            best = idx
+            best_type = dgram_type
+
+    if best == -1:
+        return None
+    else:
+        return best, best_type
+
+
 class SimradEOF(Exception):
 
     def __init__(self, message='EOF Reached!'):
@@ -128,6 +239,11 @@ class RawSimradFile(BufferedReader):
                       'IDX': simrad_parsers.SimradIDXParser(),
                       }
 
+    #: The parsers in DGRAM_TYPE_KEY keyed by the datagram type bytes as a
+    #: little-endian integer so we can dispatch without decoding the type.
+    _INT_DISPATCH = {int.from_bytes(k.encode('ascii'), 'little'): v
+                     for k, v in DGRAM_TYPE_KEY.items()}
+
     def __init__(self, name, mode='rb', closefd=True, return_raw=False, buffer_size=1024*1024):
 
         #  9-28-18 RHT: Changed RawSimradFile to implement BufferedReader instead of
@@ -140,7 +256,72 @@ class RawSimradFile(BufferedReader):
         BufferedReader.__init__(self, fio, buffer_size=buffer_size)
         self._current_dgram_offset = 0
         self._total_dgram_count = None
+        self._dgram_offsets = None
+        self._prefetch_end = None
+        self._last_nt_date = None
+        self._last_timestamp = None
+        self._peeked_header = None
         self._return_raw = return_raw
+        self._dispatch = self._INT_DISPATCH
+
+        #  scratch buffers that datagram headers and sizes are read into
+        self._hdr_buf = bytearray(16)
+        self._size_buf = bytearray(4)
+
+        #  cache the file size so we can check for EOF without seeking to
+        #  the end of the file which discards the read buffer.
+        self._file_size = os.fstat(fio.fileno()).st_size
+
+        #  we almost always read front to back so let the OS know it can
+        #  read ahead aggressively
+        self._fadvise(0, 0, 'POSIX_FADV_SEQUENTIAL')
+
+
+    def _fadvise(self, offset, length, advice):
+        '''
+        :param advice: The name of the os.POSIX_FADV_* constant to pass
+        :type advice: str
+
+        Passes an access pattern hint to the OS. This does nothing on
+        platforms that don't provide posix_fadvise.
+        '''
+
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                os.posix_fadvise(self.raw.fileno(), offset, length, getattr(os, advice))
+            except OSError:
+                pass
+
+
+    @contextmanager
+    def _scan_mode(self):
+        '''
+        Context manager for scanning through the file from the current position.
+        Asks the OS to start reading the next chunk of the file into the page
+        cache before we get to it. Call _prefetch() as the scan progresses to
+        keep the OS reading ahead of the file position.
+        '''
+
+        self._prefetch_end = self._tell_bytes()
+        self._prefetch()
+        try:
+            yield
+        finally:
+            self._prefetch_end = None
+
+
+    def _prefetch(self):
+        '''
+        Asks the OS to read the next _SCAN_READAHEAD_BYTES of the file in the
+        background when the file position gets within half that distance of
+        the end of the last chunk requested. Only used inside _scan_mode().
+        '''
+
+        pos = self._tell_bytes()
+        if pos + _SCAN_READAHEAD_BYTES // 2 >= self._prefetch_end:
+            start = max(pos, self._prefetch_end)
+            self._fadvise(start, _SCAN_READAHEAD_BYTES, 'POSIX_FADV_WILLNEED')
+            self._prefetch_end = start + _SCAN_READAHEAD_BYTES
 
 
     def _seek_bytes(self, bytes_, whence=0):
@@ -175,37 +356,25 @@ class RawSimradFile(BufferedReader):
             raise DatagramReadError('Short read while getting dgram size', (4, len(buf)),
                 file_pos=(self._tell_bytes(), self.tell()))
         else:
-            return struct.unpack('=l', buf)[0] #This return value is an int object.
-
-
-    def _bytes_remaining(self):
-        old_pos = self._tell_bytes()
-        self._seek_bytes(0, SEEK_END)
-        end_pos = self._tell_bytes()
-        offset = end_pos - old_pos
-        self._seek_bytes(old_pos, SEEK_SET)
-
-        return offset
+            return _DGRAM_SIZE_STRUCT.unpack(buf)[0] #This return value is an int object.
 
 
-    def _read_timestamp(self):
-        '''
-        Attempts to read the datagram timestamp.
+    def _read_dgram_size_unsigned(self):
         '''
+        Attempts to read the trailing size of the current datagram.
 
-        buf = self._read_bytes(8)
-        if len(buf) != 8:
-            if self.at_eof():
-                raise SimradEOF()
-            else:
-                self._seek_bytes(-len(buf), SEEK_CUR)
-                raise DatagramReadError('Short read while getting timestamp',
-                    (8, len(buf)), file_pos=(self._tell_bytes(), self.tell()))
+        The trailing size is only compared against a leading size that has
+        already been validated as >= 16 so the sign doesn't matter and we can
+        skip the struct unpack and the tuple it returns.
+        '''
 
+        buf = self._read_bytes(4)
+        if len(buf) != 4:
+            self._seek_bytes(-len(buf), SEEK_CUR)
+            raise DatagramReadError('Short read while getting dgram size', (4, len(buf)),
+                file_pos=(self._tell_bytes(), self.tell()))
         else:
-            lowDateField, highDateField = struct.unpack('=2L', buf)
-            #  11/26/19 - RHT - modified to return the raw bytes
-            return lowDateField, highDateField, buf
+            return int.from_bytes(buf, 'little')
 
 
     def _read_dgram_header(self):
@@ -220,40 +389,31 @@ class RawSimradFile(BufferedReader):
             long        highDateField
         '''
 
-        try:
-            dgram_size = self._read_dgram_size()
-        except Exception:
-            if self.at_eof():
-                raise SimradEOF()
-            else:
-                raise
+        #  read the whole header into our scratch buffer
+        n_read = self.readinto(self._hdr_buf)
 
-        #  get the datagram type
-        buf = self._read_bytes(4)
-
-        if len(buf) != 4:
+        if n_read < 4:
+            #  short read while getting the size - rewind
+            self._seek_bytes(-n_read, SEEK_CUR)
             if self.at_eof():
                 raise SimradEOF()
             else:
-                self._seek_bytes(-len(buf), SEEK_CUR)
-                raise DatagramReadError('Short read while getting dgram type', (4, len(buf)),
+                raise DatagramReadError('Short read while getting dgram size', (4, n_read),
                     file_pos=(self._tell_bytes(), self.tell()))
-        else:
-            dgram_type = buf
-        dgram_type = dgram_type.decode('iso-8859-1')
+        elif n_read < 16:
+            #  a short read after the size can only happen at the end of the file
+            raise SimradEOF()
+
+        dgram_size = _DGRAM_SIZE_STRUCT.unpack_from(self._hdr_buf, 0)[0]
+        lowDateField, highDateField = _TIMESTAMP_STRUCT.unpack_from(self._hdr_buf, 8)
 
         #  11/26/19 - RHT
         #  As part of the rewrite of read to remove the reverse seeking,
         #  store the raw header bytes so we can prepend them to the raw
-        #  data bytes and pass it all to the parser.
-        raw_bytes = buf
-
-        #  read the timestamp - this method was also modified to return
-        #  the raw bytes
-        lowDateField, highDateField, buf = self._read_timestamp()
-
-        #  add the timestamp bytes to the raw_bytes string
-        raw_bytes += buf
+        #  data bytes and pass it all to the parser. These must be copied
+        #  out of the scratch buffer since it is reused for the next header.
+        raw_bytes = bytes(self._hdr_buf[4:16])
+        dgram_type = raw_bytes[:4].decode('iso-8859-1')
 
         #  set the total bytes of this datagram including header and trailing size
         bytes_read = dgram_size + 20
@@ -270,6 +430,49 @@ class RawSimradFile(BufferedReader):
         return BufferedReader.read(self, k)
 
 
+    def _read_full_dgram_bytes(self):
+        '''
+        Attempts to read the next datagram, reading the leading size first so
+        the header and payload can be read with a single read.
+
+        Returns the datagram header and payload as a raw string or None if the
+        datagram could not be read this way. In that case the file pointer is
+        left where it was and the caller should fall back to reading the
+        datagram field by field which handles short reads and bad sizes.
+
+        This is called for every datagram so it calls the BufferedReader
+        methods directly instead of going through our _read_bytes, _seek_bytes,
+        and _tell_bytes wrappers.
+        '''
+
+        #  read the leading size into our scratch buffer. Don't use
+        #  BufferedReader.peek here, it returns a copy of the entire read buffer.
+        size_buf = self._size_buf
+        n_read = BufferedReader.readinto(self, size_buf)
+        if n_read != 4:
+            BufferedReader.seek(self, -n_read, SEEK_CUR)
+            return None
+        dgram_size = _DGRAM_SIZE_STRUCT.unpack_from(size_buf)[0]
+
+        #  check that the size is sane and that the rest of the datagram fits
+        #  in the file
+        if dgram_size < 16 or dgram_size + 4 > self._file_size - BufferedReader.tell(self):
+            BufferedReader.seek(self, -4, SEEK_CUR)
+            return None
+
+        #  read the header and payload straight into the bytes object we pass
+        #  to the parser so the payload is only copied once.
+        raw_dgram = BufferedReader.read(self, dgram_size)
+
+        #  check the trailing size - we can compare the raw bytes directly
+        if BufferedReader.read(self, 4) != size_buf:
+            #  failed size check - rewind
+            BufferedReader.seek(self, -(dgram_size + 8), SEEK_CUR)
+            return None
+
+        return raw_dgram
+
+
     def _read_next_dgram(self, header=None):
         '''
         Attempts to read the next datagram from the file.
@@ -284,72 +487,94 @@ class RawSimradFile(BufferedReader):
         #  allows us to pass them onto the parser without having to
         #  rewind and read again as was previously done.
 
-        #  try to read the header of the next datagram
+        #  use the header from a previous call to peek. If a header was passed
+        #  in, the peeked header is spent either way since the file pointer is
+        #  already at the payload.
         if header is None:
-            #  store our current location in the file
-            old_file_pos = self._tell_bytes()
+            if self._peeked_header is not None:
+                header = self._peeked_header
+                self._peeked_header = None
+        else:
+            self._peeked_header = None
 
-            try:
-                #  read the datagram header
-                header = self._read_dgram_header()
-            except DatagramReadError as e:
-                e.message = 'Short read while getting raw file datagram header'
-                raise e
+        #  Loop until we read a datagram. If we find a bad datagram we search
+        #  for the next one and go around again.
+        while True:
+            #  try to read the entire datagram in one go
+            if header is None:
+                raw_dgram = self._read_full_dgram_bytes()
+                if raw_dgram is not None:
+                    break
 
-        else:
-            #  we've already read the header so subtract 16 bytes from the
-            #  current position.
-            old_file_pos = self._tell_bytes() - 16
+            #  try to read the header of the next datagram
+            if header is None:
+                #  store our current location in the file
+                old_file_pos = self._tell_bytes()
 
-        #  basic sanity check on size
-        if header['size'] < 16:
-            #  size can't be smaller than the header size
-            log.warning('Invalid datagram header: size: %d, type: %s, nt_date: %s.  dgram_size < 16',
-                header['size'], header['type'], str((header['low_date'], header['high_date'])))
+                try:
+                    #  read the datagram header
+                    header = self._read_dgram_header()
+                except DatagramReadError as e:
+                    e.message = 'Short read while getting raw file datagram header'
+                    raise e
 
-            #  see if we can find the next datagram
-            self._find_next_datagram()
+            else:
+                #  we've already read the header so subtract 16 bytes from the
+                #  current position.
+                old_file_pos = self._tell_bytes() - 16
 
-            #  and then return that
-            return self._read_next_dgram()
+            #  basic sanity check on size
+            if header['size'] < 16:
+                #  size can't be smaller than the header size
+                log.warning('Invalid datagram header: size: %d, type: %s, nt_date: %s.  dgram_size < 16',
+                    header['size'], header['type'], str((header['low_date'], header['high_date'])))
 
-        #  get the raw bytes from the header
-        raw_dgram = header['raw_bytes']
+                #  see if we can find the next datagram
+                self._find_next_datagram()
 
-        #  and append the rest of the datagram - we subtract 12
-        #  since we have already read 12 bytes: 4 for type and
-        #  8 for time.
-        raw_dgram += self._read_bytes(header['size'] - 12)
+                #  and then try to read that
+                header = None
+                continue
 
-        #  determine the size of the payload in bytes
-        bytes_read = len(raw_dgram)
+            #  back up over the 12 bytes of the header we have already read (4 for
+            #  type and 8 for time) and read the header and payload in one go.
+            #  This is cheaper than appending the payload to header['raw_bytes']
+            #  which copies the whole payload a second time.
+            self._seek_bytes(-12, SEEK_CUR)
+            raw_dgram = self._read_bytes(header['size'])
 
-        #  and make sure it checks out
-        if bytes_read < header['size']:
-            log.warning('Datagram %d (@%d) shorter than expected length:  %d < %d', self.tell(),
-                        old_file_pos, bytes_read, header['size'])
-            self._find_next_datagram()
-            return self._read_next_dgram()
+            #  determine the size of the payload in bytes
+            bytes_read = len(raw_dgram)
 
-        #  now read the trailing size value
-        try:
-            dgram_size_check = self._read_dgram_size()
-        except DatagramReadError as e:
-            self._seek_bytes(old_file_pos, SEEK_SET)
-            e.message = 'Short read while getting trailing raw file datagram size for check'
-            raise e
+            #  and make sure it checks out
+            if bytes_read < header['size']:
+                log.warning('Datagram %d (@%d) shorter than expected length:  %d < %d', self.tell(),
+                            old_file_pos, bytes_read, header['size'])
+                self._find_next_datagram()
+                header = None
+                continue
 
-        #  make sure they match
-        if header['size'] != dgram_size_check:
-            log.warning('Datagram failed size check:  %d != %d @ (%d, %d)',
-                header['size'], dgram_size_check, self._tell_bytes(), self.tell())
-            self._find_next_datagram()
+            #  now read the trailing size value
+            try:
+                dgram_size_check = self._read_dgram_size_unsigned()
+            except DatagramReadError as e:
+                self._seek_bytes(old_file_pos, SEEK_SET)
+                e.message = 'Short read while getting trailing raw file datagram size for check'
+                raise e
+
+            #  make sure they match
+            if header['size'] != dgram_size_check:
+                log.warning('Datagram failed size check:  %d != %d @ (%d, %d)',
+                    header['size'], dgram_size_check, self._tell_bytes(), self.tell())
+                self._find_next_datagram()
+                header = None
+                continue
 
-            return self._read_next_dgram()
+            break
 
         #  add the header (16 bytes) and repeated size (4 bytes) to the payload
         #  bytes to get the total bytes read for this datagram.
-        bytes_read = bytes_read + 20
+        bytes_read = len(raw_dgram) + 20
 
         if self._return_raw:
             self._current_dgram_offset += 1
@@ -378,15 +603,20 @@ class RawSimradFile(BufferedReader):
 
         #  07/17/22 - RHT - Modified to partially parse unknown datagram types
 
-        dgram_type = raw_datagram_string[:3].decode('iso-8859-1')
-        try:
-            parser = self.DGRAM_TYPE_KEY[dgram_type]
-            nice_dgram = parser.from_string(raw_datagram_string, bytes_read)
-        except KeyError:
-            #  Unknown datagram type
+        #  look up the parser using the first 3 bytes of the type as an int
+        dgram_key = (raw_datagram_string[0] | (raw_datagram_string[1] << 8) |
+                (raw_datagram_string[2] << 16))
+        parser = self._dispatch.get(dgram_key)
+        if parser is not None:
+            try:
+                return parser.from_string(raw_datagram_string, bytes_read)
+            except KeyError:
+                pass
 
-            parser = simrad_parsers.SimradUnknownParser(dgram_type)
-            nice_dgram = parser.from_string(raw_datagram_string, bytes_read)
+        #  Unknown datagram type
+        dgram_type = raw_datagram_string[:3].decode('iso-8859-1')
+        parser = simrad_parsers.SimradUnknownParser(dgram_type)
+        nice_dgram = parser.from_string(raw_datagram_string, bytes_read)
 
         return nice_dgram
 
@@ -394,7 +624,9 @@ class RawSimradFile(BufferedReader):
     def _set_total_dgram_count(self):
         '''
         Skips quickly through the file counting datagrams and stores the
-        resulting number in self._total_dgram_count
+        resulting number in self._total_dgram_count. If the file contains no bad
+        datagrams, the byte offset of each datagram is stored in
+        self._dgram_offsets which allows seek to jump directly to a datagram.
 
         :raises: ValueError if self._total_dgram_count is not None (it has been set before)
         '''
@@ -402,41 +634,105 @@ class RawSimradFile(BufferedReader):
             raise ValueError('self._total_dgram_count has already been set. ' +
                     'Call .reset() first if you really want to recount')
 
+        #  try to count the datagrams without reading them
+        dgram_offsets = self._get_dgram_offsets_mmap()
+        if dgram_offsets is not None:
+            self._dgram_offsets = dgram_offsets
+            self._total_dgram_count = len(dgram_offsets)
+            return
+
         #Save current position for later
+        self._unpeek()
         old_file_pos = self._tell_bytes()
         old_dgram_offset = self.tell()
 
         self._current_dgram_offset = 0
         self._seek_bytes(0, SEEK_SET)
 
-        while True:
-            try:
-                self.skip()
-            except (DatagramReadError, SimradEOF):
-                self._total_dgram_count = self.tell()
-                break
+        with self._scan_mode():
+            while True:
+                try:
+                    self.skip()
+                except (DatagramReadError, SimradEOF):
+                    self._total_dgram_count = self.tell()
+                    break
+                self._prefetch()
 
         #Return to where we started
         self._seek_bytes(old_file_pos, SEEK_SET)
         self._current_dgram_offset = old_dgram_offset
 
 
-    def at_eof(self):
-        old_pos = self._tell_bytes()
-        self._seek_bytes(0, SEEK_END)
-        eof_pos = self._tell_bytes()
+    def _get_dgram_offsets_mmap(self):
+        '''
+        Finds the datagrams in the file by memory mapping it and walking the
+        datagram sizes. This doesn't use or change the file position.
 
-        #Check to see if we're at the end of file and raise EOF
-        if old_pos == eof_pos:
-            return True
+        Returns an int64 array containing the byte offset of each datagram or
+        None if a bad datagram was found.
+        Bad datagrams require searching for the next datagram which is left
+        to the slower, skip() based counting in _set_total_dgram_count.
+        '''
 
-        #Otherwise, go back to where we were and re-raise the original
-        #exception
-        else:
-            offset = old_pos - eof_pos
-            self._seek_bytes(offset, SEEK_END)
+        if self._file_size == 0:
+            return np.empty(0, dtype=np.int64)
+
+        mm = mmap.mmap(self.raw.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mm, 'madvise'):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        try:
+            file_size = len(mm)
+            p = 0
+            #  collect offsets as packed int64s rather than a list of Python
+            #  ints so the array can be handed to numpy without a copy
+            dgram_offsets = array.array('q')
+            append = dgram_offsets.append
+            unpack_from = _DGRAM_SIZE_STRUCT.unpack_from
+            while file_size - p >= 16:
+                dgram_size = unpack_from(mm, p)[0]
+                if dgram_size < 16:
+                    return None
+
+                #  a truncated datagram at the end of the file isn't counted
+                if p + dgram_size + 8 > file_size:
+                    break
+
+                if unpack_from(mm, p + dgram_size + 4)[0] != dgram_size:
+                    return None
+
+                append(p)
+                p += dgram_size + 8
+        finally:
+            mm.close()
+
+        return np.frombuffer(dgram_offsets, dtype=np.int64)
+
+
+    def _seek_dgram_offsets(self, dgram_index):
+        '''
+        :param dgram_index: The datagram to seek to
+        :type dgram_index: int
+
+        Seeks directly to a datagram using the offsets found by
+        _set_total_dgram_count. Returns False if the offsets are not
+        available or the datagram isn't in the file.
+        '''
+
+        if self._dgram_offsets is None or not 0 <= dgram_index < len(self._dgram_offsets):
             return False
 
+        self._seek_bytes(int(self._dgram_offsets[dgram_index]), SEEK_SET)
+        self._current_dgram_offset = dgram_index
+
+        return True
+
+
+    def at_eof(self):
+
+        #  compare against the file size cached in __init__ - seeking to
+        #  the end of the file here would discard the read buffer.
+        return self._tell_bytes() >= self._file_size
+
 
     def read(self, k, header=None):
         '''
@@ -475,16 +771,76 @@ class RawSimradFile(BufferedReader):
             return self.readall()
 
 
-    def readall(self):
+    def readall(self, n_workers=1):
         '''
+        :param n_workers: The number of worker processes used to parse the file.
+        :type n_workers: int
+
         Reads the entire file from the beginning and returns a list of datagrams.
+
+        If n_workers > 1 the datagrams are split into contiguous ranges which are
+        parsed in parallel by worker processes. This requires that the file has
+        no bad datagrams, otherwise the file is read serially. Since the parsed
+        datagrams have to be passed back from the workers this is only faster
+        for files where parsing dominates, e.g. XML or complex sample data.
         '''
 
         self.seek(0, SEEK_SET)
+
+        if n_workers > 1:
+            dgram_list = self._readall_parallel(n_workers)
+            if dgram_list is not None:
+                return dgram_list
+
         dgram_list = []
 
-        for raw_dgram in self.iter_dgrams():
-            dgram_list.append(raw_dgram)
+        with self._scan_mode():
+            for raw_dgram in self.iter_dgrams():
+                dgram_list.append(raw_dgram)
+                self._prefetch()
+
+        return dgram_list
+
+
+    def _readall_parallel(self, n_workers):
+        '''
+        Reads the entire file using n_workers processes. Returns None if the file
+        can't be read in parallel.
+        '''
+
+        #  the workers re-open the file so we need a path
+        if not isinstance(self.name, (str, bytes, os.PathLike)):
+            return None
+
+        #  find the datagrams
+        try:
+            self._set_total_dgram_count()
+        except ValueError:
+            pass
+        if self._dgram_offsets is None:
+            return None
+
+        #  split the datagrams into contiguous ranges, one per worker. Don't
+        #  start more workers than there are CPUs.
+        n_workers = min(n_workers, os.cpu_count() or 1)
+        ranges = [r for r in np.array_split(np.arange(self._total_dgram_count), n_workers)
+                if len(r) > 0]
+
+        #  there are no complete datagrams so leave it to the serial read
+        if not ranges:
+            return None
+
+        dgram_list = []
+        with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(_read_dgram_range, self.name,
+                    int(self._dgram_offsets[r[0]]), len(r), self._return_raw)
+                    for r in ranges]
+            for future in futures:
+                dgram_list.extend(future.result())
+
+        #  leave the file at the end like a serial read would
+        self._seek_bytes(0, SEEK_END)
+        self._current_dgram_offset = self._total_dgram_count
 
         return dgram_list
 
@@ -497,22 +853,21 @@ class RawSimradFile(BufferedReader):
         the file.
         '''
 
-        #  define the regex pattern used to search for datagrams
-        #  (don't search for non-repeating datagrams)
-        re_pattern = b'RAW|NME|TAG|BOT|DEP|XML|MRU'
-
         #  Set the search buffer size in bytes
         search_buf_bytes = 1024 * 1024 * 10
 
+        #  The number of bytes to back up between search buffers so we don't
+        #  miss a datagram type that straddles the end of a buffer
+        overlap_bytes = len(_RESYNC_DGRAM_TYPES[0]) - 1
+
         #  set up
         initial_file_pos = self._tell_bytes()
-        current_file_pos = initial_file_pos
-        found_match = False
         log.warning('Attempting to find next valid datagram...')
 
         #  search until a match or the end of the file
-        while not found_match:
+        while True:
             #  read some bytes
+            current_file_pos = self._tell_bytes()
             buf = self._read_bytes(search_buf_bytes)
 
             #  check if we're at the end
@@ -520,26 +875,29 @@ class RawSimradFile(BufferedReader):
                 raise SimradEOF()
 
             #  check of a datagram header
-            matches = re.finditer(re_pattern, buf)
+            match = _search_dgram_types(buf)
 
-            for match in matches:
+            if match is not None:
                 #  We have found text that matches one of our datagrams
 
                 #  compute the offset to this datagram from the beginning of the file
                 #  remembering to subtract the 4 bytes for the datagram size
-                next_dgram = current_file_pos + match.start() - 4
+                next_dgram = current_file_pos + match[0] - 4
 
                 #  issue a warning
-                log.warning('Found next datagram:  %s @ %d', match.group().decode('utf-8'), next_dgram)
+                log.warning('Found next datagram:  %s @ %d', match[1].decode('utf-8'), next_dgram)
 
                 #  seek to the datagram
                 self._seek_bytes(next_dgram)
                 log.warning('%d bytes were skipped.', next_dgram - initial_file_pos)
-                found_match = True
-                break
+                return
 
-            #  update the current position
-            current_file_pos = current_file_pos + search_buf_bytes
+            #  a short read means we've searched to the end of the file
+            if len(buf) < search_buf_bytes:
+                raise SimradEOF()
+
+            #  back up a little so the next buffer overlaps this one
+            self._seek_bytes(-overlap_bytes, SEEK_CUR)
 
 
     def tell(self):
@@ -578,17 +936,35 @@ class RawSimradFile(BufferedReader):
         dgram_header = self.peek(rewind=False)
 
         #  add some convenience values to the header dict
-        us_past_nt_epoch = ((dgram_header['high_date'] << 32) + dgram_header['low_date']) // 10
-        dgram_header['timestamp'] = UTC_NT_EPOCH + datetime.timedelta(microseconds=us_past_nt_epoch)
+        dgram_header['timestamp'] = self._nt_to_datetime(dgram_header['low_date'],
+                dgram_header['high_date'])
         dgram_header['bytes_read'] = dgram_header['size'] + 20
 
         return dgram_header
 
 
+    def _nt_to_datetime(self, low_date, high_date):
+        '''
+        Converts a datagram NT date to a datetime object.
+
+        Datagrams for each channel in a ping share the same time, so the last
+        conversion is cached and returned again if the next datagram has the
+        same NT date. datetime objects are immutable so sharing them is safe.
+        '''
+
+        nt_date = (high_date << 32) + low_date
+        if nt_date != self._last_nt_date:
+            self._last_timestamp = UTC_NT_EPOCH + datetime.timedelta(0, 0, nt_date // 10)
+            self._last_nt_date = nt_date
+
+        return self._last_timestamp
+
+
     def peek(self, rewind=True):
         '''
-        Returns the header of the next datagram in the file.  The file position is
-        reset back to the original location afterwards.
+        Returns the header of the next datagram in the file without consuming
+        the datagram. The next call to read or skip will return or skip the
+        datagram as if the file position was reset back to the original location.
 
         Set rewind to False to leave the file pointer at the first byte of the
         datagram payload. This is equivalent to the _get_datagram_header() method
@@ -597,34 +973,48 @@ class RawSimradFile(BufferedReader):
         :returns: [dgram_size, dgram_type, (low_date, high_date), channel_id]
         '''
 
+        #  return the header we already peeked at - the file pointer is
+        #  already at the start of the payload
+        if self._peeked_header is not None:
+            dgram_header = self._peeked_header
+            if not rewind:
+                self._peeked_header = None
+            return dgram_header
+
         #  read the next dgram header
         dgram_header = self._read_dgram_header()
 
         if dgram_header['type'].startswith('RAW0'):
-            dgram_header['channel'] = struct.unpack('h', self._read_bytes(2))[0]
-            if rewind:
-                #  rewind to the beginning of the datagram
-                self._seek_bytes(-18, SEEK_CUR)
-            else:
-                #  rewind to the beginning of the payload
-                self._seek_bytes(-2, SEEK_CUR)
+            dgram_header['channel'] = _RAW0_CHAN_STRUCT.unpack(self._read_bytes(2))[0]
+            #  rewind to the beginning of the payload
+            self._seek_bytes(-2, SEEK_CUR)
         elif dgram_header['type'].startswith('RAW3') or dgram_header['type'].startswith('RAW4'):
-            chan_id = struct.unpack('128s', self._read_bytes(128))[0]
+            chan_id = _RAW3_CHANID_STRUCT.unpack(self._read_bytes(128))[0]
             dgram_header['channel_id'] = chan_id.strip(b'\x00')
-            if rewind:
-                #  rewind to the beginning of the datagram
-                self._seek_bytes(-144, SEEK_CUR)
-            else:
-                #  rewind to the beginning of the payload
-                self._seek_bytes(-128, SEEK_CUR)
-        else:
-            #  The file pointer is always pointing at the payload for non RAW datagrams.
-            if rewind:
-                self._seek_bytes(-16, SEEK_CUR)
+            #  rewind to the beginning of the payload
+            self._seek_bytes(-128, SEEK_CUR)
+
+        #  The file pointer is now pointing at the payload. Rather than rewinding
+        #  to the beginning of the datagram, which would make the next read
+        #  read the header again, keep the header for the next read or skip.
+        if rewind:
+            self._peeked_header = dgram_header
 
         return dgram_header
 
 
+    def _unpeek(self):
+        '''
+        Moves the file pointer back to the start of the datagram if peek left
+        a header for the next read. Call this before anything that changes
+        the file position other than read or skip.
+        '''
+
+        if self._peeked_header is not None:
+            self._peeked_header = None
+            self._seek_bytes(-16, SEEK_CUR)
+
+
     def __next__(self):
         '''
         Returns the next datagram (synonomous with self.read(1))
@@ -653,7 +1043,14 @@ class RawSimradFile(BufferedReader):
         '''
 
         if header is None:
-            header = self._read_dgram_header()
+            if self._peeked_header is not None:
+                header = self._peeked_header
+                self._peeked_header = None
+            else:
+                header = self._read_dgram_header()
+        else:
+            #  the file pointer is at the payload so any peeked header is spent
+            self._peeked_header = None
 
         if header['size'] < 16:
             log.warning('Invalid datagram header: size: %d, type: %s, nt_date: %s.  dgram_size < 16',
@@ -666,7 +1063,7 @@ class RawSimradFile(BufferedReader):
             self._seek_bytes(header['size'] - 12, SEEK_CUR)
 
             #  check the trailing size
-            dgram_size_check = self._read_dgram_size()
+            dgram_size_check = self._read_dgram_size_unsigned()
 
             if header['size'] != dgram_size_check:
                 log.warning('Datagram failed size check:  %d != %d @ (%d, %d)',
@@ -686,6 +1083,8 @@ class RawSimradFile(BufferedReader):
         THIS IS PROBABLY BROKEN
         '''
 
+        self._unpeek()
+
         old_file_pos = self._tell_bytes()
 
         try:
@@ -732,7 +1131,7 @@ class RawSimradFile(BufferedReader):
                 new_dgram = next(self)
             except Exception:
                 log.debug('Caught EOF?')
-                raise StopIteration
+                return
 
             yield new_dgram
 
@@ -758,9 +1157,13 @@ class RawSimradFile(BufferedReader):
         instead of raw bytes.
         '''
 
+        self._unpeek()
+
         if whence == SEEK_SET:
             if offset < 0:
                 raise ValueError('Cannot seek backwards from beginning of file')
+            elif offset > 0 and self._seek_dgram_offsets(offset):
+                return
             else:
                 self._seek_bytes(0, SEEK_SET)
                 self._current_dgram_offset = 0
@@ -775,11 +1178,15 @@ class RawSimradFile(BufferedReader):
             except ValueError:
                 pass
 
+            if offset < 0 and self._seek_dgram_offsets(self._total_dgram_count + offset):
+                return
+
             self._seek_bytes(0, SEEK_END)
             self._current_dgram_offset = self._total_dgram_count
 
         elif whence == SEEK_CUR:
-            pass
+            if offset != 0 and self._seek_dgram_offsets(self.tell() + offset):
+                return
         else:
             raise ValueError('Illegal value for \'whence\' (%s), use 0 (beginning), 1 (current), or 2 (end)' % (str(whence)))
 
@@ -792,6 +1199,27 @@ class RawSimradFile(BufferedReader):
 
 
     def reset(self):
+        self._peeked_header = None
         self._current_dgram_offset = 0
         self._total_dgram_count = None
+        self._dgram_offsets = None
         self._seek_bytes(0, SEEK_SET)
+
+
+def _read_dgram_range(name, start_byte, n_dgrams, return_raw):
+    '''
+    Worker for RawSimradFile.readall. Opens the file, seeks to start_byte and
+    returns a list of the next n_dgrams datagrams.
+    '''
+
+    fid = RawSimradFile(name, 'rb', return_raw=return_raw)
+    try:
+        fid._seek_bytes(start_byte, SEEK_SET)
+        dgram_list = []
+        with fid._scan_mode():
+            for _ in range(n_dgrams):
+                dgram_list.append(fid._read_next_dgram())
+                fid._prefetch()
+        return dgram_list
+    finally:
+        fid.close()
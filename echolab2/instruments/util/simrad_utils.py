@@ -33,6 +33,63 @@ $Id$
 '''
 
 import os
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+
+#  directory listings are cached for a short time so reading a batch of files
+#  from the same directory doesn't re-read the directory for each file.
+_DIR_CACHE_TTL = 2.0
+_dir_cache = {}
+
+#  XYZ filename suffixes cached by data object and raw_index
+_xyz_suffix_cache = weakref.WeakKeyDictionary()
+
+
+def clear_bottom_file_cache():
+    '''clear_bottom_file_cache clears the cached directory listings used when
+    searching for bottom files. Call this if you are watching a directory for new
+    .bot or XYZ files and need them found before the cache expires.
+    '''
+
+    _dir_cache.clear()
+
+
+def _list_dir(path):
+    '''_list_dir returns a dictionary mapping the lower case name of each file in
+    the provided directory to its name on disk. Looking up lower case names makes
+    matching case insensitive on all platforms and the values let us return paths
+    with the case used on disk. An empty dictionary is returned if the directory
+    can't be read. Listings are cached for _DIR_CACHE_TTL seconds.
+    '''
+
+    now = time.monotonic()
+    cached = _dir_cache.get(path)
+    if cached is not None and now - cached[0] <= _DIR_CACHE_TTL:
+        return cached[1]
+
+    try:
+        with os.scandir(path) as entries:
+            names = {e.name.lower(): e.name for e in entries if e.is_file()}
+    except OSError:
+        names = {}
+
+    _dir_cache[path] = (now, names)
+
+    return names
+
+
+def _strip_ext(path):
+    '''_strip_ext returns the path without its file extension. This is a lighter
+    weight os.path.splitext(path)[0] for the .raw file names passed to the bottom
+    file functions.
+    '''
+
+    i = path.rfind('.')
+    j = max(path.rfind('/'), path.rfind('\\'))
+
+    return path[:i] if i > j else path
 
 
 def get_simrad_bottom_files(datafile_name, data_object, prefer_xyz=True, skip_xyz=False):
@@ -53,45 +110,126 @@ def get_simrad_bottom_files(datafile_name, data_object, prefer_xyz=True, skip_xy
 
     skip_xyz (bool): Set this to True to skip checking for XYZ files. This would be
         appropriate when working with EK/ES60 data where XYZ files are not generated.
+
+    Returns one of:
+        ('XYZ', dict): a non-empty dictionary, keyed by channel ID, containing the
+            XYZ filename for each channel that has one.
+        ('BOT', str): the .bot filename.
+        (None, None): no bottom files were found.
+    '''
+
+    return get_simrad_bottom_files_batch([datafile_name], data_object,
+            prefer_xyz=prefer_xyz, skip_xyz=skip_xyz)[datafile_name]
+
+
+def get_simrad_bottom_files_batch(datafile_names, data_object, prefer_xyz=True,
+        skip_xyz=False):
+    '''get_simrad_bottom_files_batch searches for the XYZ and/or .bot files for a
+    list of datafiles. It returns a dictionary, keyed by datafile name, containing
+    the (type, bottom_files) tuple that get_simrad_bottom_files would return for
+    that file: ('XYZ', dict), ('BOT', str) or (None, None). Each directory is
+    listed once and the XYZ filename suffixes are computed once for the whole
+    batch.
+
+    datafile_names (list): a list of full paths to the .raw files that you wish to
+        get the matching bottom data files for.
+
+    See get_simrad_bottom_files for a description of the other arguments.
     '''
 
-    #  get the base file name
-    basename = os.path.splitext(datafile_name)[0]
+    #  group the datafiles by directory
+    datafiles_by_dir = {}
+    for datafile_name in datafile_names:
+        dir_name = os.path.dirname(datafile_name) or '.'
+        datafiles_by_dir.setdefault(dir_name, []).append(datafile_name)
+
+    #  the XYZ suffixes only depend on the data object's channels
+    xyz_suffixes = None
+    if not skip_xyz:
+        xyz_suffixes = _get_xyz_suffixes(data_object)
+
+    #  list the directories. When the files span more than one directory, list
+    #  them in parallel since each listing can block on a slow network share.
+    dir_names = list(datafiles_by_dir)
+    if len(dir_names) > 1:
+        with ThreadPoolExecutor(max_workers=min(32, len(dir_names))) as executor:
+            dir_listings = dict(zip(dir_names, executor.map(_list_dir, dir_names)))
+    else:
+        dir_listings = {dir_name: _list_dir(dir_name) for dir_name in dir_names}
+
+    bottom_files = {}
+    for dir_name, dir_datafiles in datafiles_by_dir.items():
+        existing = dir_listings[dir_name]
+        for datafile_name in dir_datafiles:
+            #  get the base file name
+            basename = _strip_ext(datafile_name)
 
-    type = None
-    bottom_files = None
+            bottom_files[datafile_name] = _match_bottom_files(basename, existing,
+                    xyz_suffixes, prefer_xyz, skip_xyz)
+
+    return bottom_files
+
+
+def _match_bottom_files(basename, existing, xyz_suffixes, prefer_xyz, skip_xyz):
+    '''_match_bottom_files returns the (type, bottom_files) tuple for a single
+    datafile given the set of files in its directory.
+    '''
 
     if not skip_xyz and prefer_xyz:
-        bottom_files = get_xyz_filenames(basename, data_object)
-        if len(bottom_files) == 0:
-            bottom_files = get_bot_filename(basename)
-            if bottom_files:
-                type = 'BOT'
-        else:
-            #  for now we
-            type = 'XYZ'
+        xyz_files = _match_xyz_files(basename, existing, xyz_suffixes)
+        if xyz_files:
+            return 'XYZ', xyz_files
+
+        bot_file = _match_bot_file(basename, existing)
+        if bot_file:
+            return 'BOT', bot_file
+
     else:
-        bottom_files = get_bot_filename(basename)
-        type = 'BOT'
+        bot_file = _match_bot_file(basename, existing)
+        if bot_file:
+            return 'BOT', bot_file
 
-        if not bottom_files and not skip_xyz:
-            bottom_files = get_xyz_filenames(basename, data_object)
-            type = 'XYZ'
+        if not skip_xyz:
+            xyz_files = _match_xyz_files(basename, existing, xyz_suffixes)
+            if xyz_files:
+                return 'XYZ', xyz_files
 
-    return type, bottom_files
+    return None, None
 
 
 def get_xyz_filenames(basename, data_object, raw_index=0):
 
-    #  look for XYZ files adjacent to the datafile
-    xyz_files = {}
-    for channel_id in data_object.raw_data:
+    #  By default we assume the user is working with a single data type and
+    #  we grab the first raw_data object in the channel's list of raw objects.
+    #  If you're reading multiple files containing different data types, you
+    #  may need to set the raw_index value when calling this function.
+    xyz_suffixes = _get_xyz_suffixes(data_object, raw_index=raw_index)
+
+    return _match_xyz_files(basename, _list_dir(os.path.dirname(basename) or '.'),
+            xyz_suffixes)
+
+
+def _get_xyz_suffixes(data_object, raw_index=0):
+    '''_get_xyz_suffixes returns a dictionary, keyed by channel ID, containing the
+    string that is appended to a datafile's base name to get that channel's XYZ
+    filename.
+
+    The suffixes are cached for each data object and raw_index. A suffix only
+    depends on the channel ID and short channel ID so the cache is checked against
+    those and rebuilt when channels are added or their short IDs change.
+    '''
 
-        #  By default we assume the user is working with a single data type and
-        #  we grab the first raw_data object in the channel's list of raw objects.
-        #  If you're reading multiple files containing different data types, you
-        #  may need to set the raw_index value when calling this function.
-        raw_obj = data_object.raw_data[channel_id][raw_index]
+    channel_ids = tuple((channel_id,
+            data_object.raw_data[channel_id][raw_index].configuration[-1]['channel_id_short'])
+            for channel_id in data_object.raw_data)
+
+    obj_cache = _xyz_suffix_cache.setdefault(data_object, {})
+    cached = obj_cache.get(raw_index)
+    if cached is not None and cached[0] == channel_ids:
+        return cached[1]
+
+    xyz_suffixes = {}
+    for channel_id, channel_id_short in channel_ids:
 
         #  check for a MUX/Sequence ID
         mux_id = channel_id.split('_')
@@ -102,48 +240,71 @@ def get_xyz_filenames(basename, data_object, raw_index=0):
 
         #  generate the xyz file channel id using the "short" id and
         #  replacing the colon (illegal filename character) with a space
-        xyz_id = raw_obj.configuration[-1]['channel_id_short'].replace(':',' ')
+        xyz_id = channel_id_short.replace(':',' ')
 
         #  add the mux/sequence ID
         if mux_id:
             xyz_id += '-' + mux_id
 
-        #  and build the xyz filename
-        xyz_filename = basename + '-' + xyz_id + '.XYZ'
+        xyz_suffixes[channel_id] = '-' + xyz_id + '.XYZ'
 
-        #  check if this file exists
-        if os.path.isfile(xyz_filename):
-            xyz_files[channel_id] = xyz_filename
+    #  keep the channel IDs so the cached suffixes can be validated
+    obj_cache[raw_index] = (channel_ids, xyz_suffixes)
 
-    return xyz_files
+    return xyz_suffixes
 
 
-def get_bot_filename(basename):
+def _match_xyz_files(basename, existing, xyz_suffixes):
 
-    bot_file = None
+    dir_name, file_base = os.path.split(basename)
+    file_base = file_base.lower()
 
-    #  build the bot filename
-    bot_filename = basename + '.bot'
+    #  look for XYZ files adjacent to the datafile
+    xyz_files = {}
+    for channel_id, xyz_suffix in xyz_suffixes.items():
 
-    #  check if this file exists
-    if os.path.isfile(bot_filename):
-        bot_file = bot_filename
-    else:
-        #  in rare cases the bot filename will be off by a second, check for this here
-        try:
-            sec_base = int(basename[-1])
-            basename = basename[:-1]
-
-            sec_val = str(sec_base + 1)
-            bot_filename = basename + sec_val + '.bot'
-            if os.path.isfile(bot_filename):
-                bot_file = bot_filename
-            else:
-                sec_val = str(sec_base - 1)
-                bot_filename = basename + sec_val + '.bot'
-                if os.path.isfile(bot_filename):
-                    bot_file = bot_filename
-        except:
-            pass
-
-    return bot_file
+        #  build the xyz filename and check if this file exists
+        xyz_filename = existing.get(file_base + xyz_suffix.lower())
+        if xyz_filename:
+            xyz_files[channel_id] = os.path.join(dir_name, xyz_filename)
+
+    return xyz_files
+
+
+def get_bot_filename(basename):
+
+    return _match_bot_file(basename, _list_dir(os.path.dirname(basename) or '.'))
+
+
+def _match_bot_file(basename, existing):
+
+    dir_name, file_base = os.path.split(basename)
+    file_base = file_base.lower()
+
+    #  build the bot filename and check if this file exists
+    bot_filename = existing.get(file_base + '.bot')
+    if bot_filename:
+        return os.path.join(dir_name, bot_filename)
+
+    #  in rare cases the bot filename will be off by a few seconds. Simrad file
+    #  names end in -THHMMSS so look for a .bot file from the same minute and
+    #  pick the one with the closest seconds.
+    if len(file_base) >= 7 and file_base[-7] == 't' and file_base[-6:].isdecimal():
+        sec_base = int(file_base[-2:])
+        prefix = file_base[:-2]
+        name_len = len(prefix) + 6
+        best_file = None
+        for name in existing:
+            if (len(name) == name_len and name.startswith(prefix) and
+                    name.endswith('.bot')):
+                sec_val = name[-6:-4]
+                if sec_val.isdecimal():
+                    #  on a tie the later file wins
+                    delta = int(sec_val) - sec_base
+                    candidate = (abs(delta), delta < 0, name)
+                    if best_file is None or candidate < best_file:
+                        best_file = candidate
+        if best_file is not None:
+            return os.path.join(dir_name, existing[best_file[2]])
+
+    return None